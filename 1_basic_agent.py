@@ -1,8 +1,12 @@
+import os
+import time
+
 from dotenv import load_dotenv
 load_dotenv()
 
 # from llama_index.llms.openai import OpenAI
 from llama_index.llms.google_genai import GoogleGenAI
+from google.genai import types
 
 from llama_index.core.agent.workflow import AgentWorkflow
 
@@ -16,9 +20,16 @@ def add(a: float, b: float) -> float:
 
 # llm = OpenAI(model="gpt-4o-mini")
 
+# Service tier: these one-shot demo runs are not latency sensitive, so they
+# default to Flex (about half the price). Flex uses spare capacity and may be
+# slower or shed under load; set GEMINI_TIER=standard or priority to override.
 llm = GoogleGenAI(
     model="gemini-2.0-flash",
     # api_key="some key",  # uses GOOGLE_API_KEY env var by default
+    generation_config=types.GenerateContentConfig(
+        temperature=0.1,  # GoogleGenAI's default, which a custom config replaces
+        service_tier=os.getenv("GEMINI_TIER", "flex"),
+    ),
 )
 
 workflow = AgentWorkflow.from_tools_or_functions(
@@ -31,9 +42,55 @@ async def main():
     response = await workflow.run(user_msg="What is 20+(2*4)?")
     print(response)
 
+BATCH_FILE = "batch_requests.jsonl"
+
+def batch_main(prompts: list[str]) -> list[str]:
+    """Answer prompts with Gemini Batch Mode (half the price, results arrive asynchronously).
+
+    Batch requests go straight to the model, so the agent's tools are not used.
+    """
+    import json
+    from google import genai
+
+    client = genai.Client()  # uses GOOGLE_API_KEY env var by default
+
+    with open(BATCH_FILE, "w") as f:
+        for i, prompt in enumerate(prompts):
+            request = {"contents": [{"parts": [{"text": prompt}], "role": "user"}]}
+            f.write(json.dumps({"key": f"req_{i}", "request": request}) + "\n")
+
+    uploaded = client.files.upload(
+        file=BATCH_FILE, config=types.UploadFileConfig(mime_type="jsonl")
+    )
+    job = client.batches.create(model=llm.model, src=uploaded.name)
+
+    done_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+    while job.state.name not in done_states:
+        time.sleep(30)
+        job = client.batches.get(name=job.name)
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job {job.name} ended with {job.state.name}")
+
+    # Results come back as JSONL in arbitrary order, so match them up by key
+    answers = {}
+    for line in client.files.download(file=job.dest.file_name).decode().splitlines():
+        result = json.loads(line)
+        if "response" in result:
+            answers[result["key"]] = result["response"]["candidates"][0]["content"]["parts"][0]["text"]
+        else:
+            answers[result["key"]] = f"Error: {result.get('error')}"
+    return [answers.get(f"req_{i}", "") for i in range(len(prompts))]
+
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    import sys
+
+    if os.getenv("BATCH") == "1":
+        # Non-interactive runs: BATCH=1 python 1_basic_agent.py "prompt 1" "prompt 2" ...
+        for answer in batch_main(sys.argv[1:] or ["What is 20+(2*4)?"]):
+            print(answer)
+    else:
+        import asyncio
+        asyncio.run(main())
 
 
     
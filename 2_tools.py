@@ -1,10 +1,17 @@
+import functools
+import hashlib
+import os
+import time
+
 from dotenv import load_dotenv
 load_dotenv()
 
 # from llama_index.llms.openai import OpenAI
 from llama_index.llms.google_genai import GoogleGenAI
+from google.genai import types
 
 from llama_index.core.agent.workflow import AgentWorkflow
+from llama_index.core.tools import FunctionTool
 from llama_index.tools.yahoo_finance import YahooFinanceToolSpec
 
 def multiply(a: float, b: float) -> float:
@@ -16,26 +23,120 @@ def add(a: float, b: float) -> float:
     return a + b
 
 # llm = OpenAI(model="gpt-4o-mini")
+# Service tier: these one-shot demo runs are not latency sensitive, so they
+# default to Flex (about half the price). Flex uses spare capacity and may be
+# slower or shed under load; set GEMINI_TIER=standard or priority to override.
 llm = GoogleGenAI(
     model="gemini-2.0-flash",
     # api_key="some key",  # uses GOOGLE_API_KEY env var by default
+    generation_config=types.GenerateContentConfig(
+        temperature=0.1,  # GoogleGenAI's default, which a custom config replaces
+        service_tier=os.getenv("GEMINI_TIER", "flex"),
+    ),
 )
 
-finance_tools = YahooFinanceToolSpec().to_tool_list()
-print ("FINANCIAL TOOLS ARE: ", finance_tools)
-finance_tools.extend([multiply, add])
-# we added more additonal capabiliteis to the finance_tool 
+# Yahoo Finance lookups hit the network every time. Identical calls within a
+# short window (quotes, news) or a longer one (financial statements, which
+# change quarterly) are answered from an in-memory cache instead.
+FINANCE_TOOL_TTLS = {"balance_sheet": 3600, "income_statement": 3600, "cash_flow": 3600}
+DEFAULT_TOOL_TTL = 60
 
-workflow = AgentWorkflow.from_tools_or_functions(
-    finance_tools,
-    llm=llm,
-    system_prompt="You are an agent that can perform basic mathematical operations using tools."
-)
+_tool_cache: dict[str, tuple[float, object]] = {}
+
+def cached(fn, ttl: float):
+    """Reuse a tool's result for `ttl` seconds when it is called again with the same arguments."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = hashlib.sha256(
+            (fn.__name__ + repr(args) + repr(sorted(kwargs.items()))).encode()
+        ).hexdigest()[:16]
+        hit = _tool_cache.get(key)
+        if hit and hit[0] > time.time():
+            return hit[1]
+        value = fn(*args, **kwargs)
+        _tool_cache[key] = (time.time() + ttl, value)
+        return value
+    return wrapper
+
+def with_cache(tool: FunctionTool, ttl: float) -> FunctionTool:
+    """Copy of `tool` whose function is wrapped by `cached`."""
+    return FunctionTool.from_defaults(
+        fn=cached(tool.fn, ttl),
+        name=tool.metadata.name,
+        description=tool.metadata.description,
+        fn_schema=tool.metadata.fn_schema,
+    )
+
+# built on first use, not at import time
+@functools.cache
+def get_finance_tools():
+    finance_tools = [
+        with_cache(tool, FINANCE_TOOL_TTLS.get(tool.metadata.name, DEFAULT_TOOL_TTL))
+        for tool in YahooFinanceToolSpec().to_tool_list()
+    ]
+    finance_tools.extend([FunctionTool.from_defaults(fn=multiply), FunctionTool.from_defaults(fn=add)])
+    # we added more additonal capabiliteis to the finance_tool 
+    return finance_tools
+
+def build_workflow():
+    return AgentWorkflow.from_tools_or_functions(
+        get_finance_tools(),
+        llm=llm,
+        system_prompt="You are an agent that can perform basic mathematical operations using tools."
+    )
 
 async def main():
+    workflow = build_workflow()
     response = await workflow.run(user_msg="What's the current stock price of NVIDIA?")
     print(response)
 
+BATCH_FILE = "batch_requests.jsonl"
+
+def batch_main(prompts: list[str]) -> list[str]:
+    """Answer prompts with Gemini Batch Mode (half the price, results arrive asynchronously).
+
+    Batch requests go straight to the model, so the agent's tools are not used.
+    """
+    import json
+    from google import genai
+
+    client = genai.Client()  # uses GOOGLE_API_KEY env var by default
+
+    with open(BATCH_FILE, "w") as f:
+        for i, prompt in enumerate(prompts):
+            request = {"contents": [{"parts": [{"text": prompt}], "role": "user"}]}
+            f.write(json.dumps({"key": f"req_{i}", "request": request}) + "\n")
+
+    uploaded = client.files.upload(
+        file=BATCH_FILE, config=types.UploadFileConfig(mime_type="jsonl")
+    )
+    job = client.batches.create(model=llm.model, src=uploaded.name)
+
+    done_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+    while job.state.name not in done_states:
+        time.sleep(30)
+        job = client.batches.get(name=job.name)
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job {job.name} ended with {job.state.name}")
+
+    # Results come back as JSONL in arbitrary order, so match them up by key
+    answers = {}
+    for line in client.files.download(file=job.dest.file_name).decode().splitlines():
+        result = json.loads(line)
+        if "response" in result:
+            answers[result["key"]] = result["response"]["candidates"][0]["content"]["parts"][0]["text"]
+        else:
+            answers[result["key"]] = f"Error: {result.get('error')}"
+    return [answers.get(f"req_{i}", "") for i in range(len(prompts))]
+
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    import sys
+
+    if os.getenv("BATCH") == "1":
+        # Non-interactive runs: BATCH=1 python 2_tools.py "prompt 1" "prompt 2" ...
+        # (no tools on this path, so prompts must not need live market data)
+        for answer in batch_main(sys.argv[1:] or ["In two sentences, what does a company's balance sheet show?"]):
+            print(answer)
+    else:
+        import asyncio
+        asyncio.run(main())
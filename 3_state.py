@@ -6,27 +6,48 @@ This script creates a terminal-based conversational agent that:
 - Uses Yahoo Finance tools for financial queries.
 - Uses Google GenAI as the language model (can be swapped with OpenAI).
 - Maintains conversational context (remembers past interactions).
-- Saves and restores context to/from a file (`history.json`) so the agent
-  remembers even after the script is restarted.
+- Records every turn in an append-only event log in a SQLite database
+  (`history.db`) so the agent remembers even after the script is restarted.
 """
 
 # ==============================
 # --- Imports ---
 # ==============================
 import asyncio
-import json
+import functools
+import hashlib
 import os
+import sqlite3
+import time
 from dotenv import load_dotenv
 
-# Language models (choose between OpenAI or Google GenAI)
-from llama_index.llms.openai import OpenAI
+# Fast JSON (falls back to the standard library if orjson is not installed)
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    _loads = json.loads
+
+# Language models (Google GenAI; OpenAI is imported only when selected)
 from llama_index.llms.google_genai import GoogleGenAI
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
+from google import genai
+from google.genai import errors, types
 
 # Yahoo Finance tool wrapper
 from llama_index.tools.yahoo_finance import YahooFinanceToolSpec
 
 # Agent workflow + context management
-from llama_index.core.agent.workflow import AgentWorkflow
+from llama_index.core.agent.workflow import AgentStream, AgentWorkflow, ToolCallResult
+from llama_index.core.tools import FunctionTool
 from llama_index.core.workflow import Context, JsonSerializer
 
 # ==============================
@@ -47,23 +68,194 @@ def add(a: float, b: float) -> float:
     return a + b
 
 # ==============================
-# --- Language Model Setup ---
+# --- Tools Setup ---
 # ==============================
-# Option A: OpenAI (commented out)
-# llm = OpenAI(model="gpt-4o-mini")
+# Yahoo Finance tools (stock data, etc.)
+#
+# These lookups hit the network every time. Identical calls within a
+# short window (quotes, news) or a longer one (financial statements, which
+# change quarterly) are answered from an in-memory cache instead.
+FINANCE_TOOL_TTLS = {"balance_sheet": 3600, "income_statement": 3600, "cash_flow": 3600}
+DEFAULT_TOOL_TTL = 60
+
+_tool_cache: dict[str, tuple[float, object]] = {}
+
+def cached(fn, ttl: float):
+    """Reuse a tool's result for `ttl` seconds when it is called again with the same arguments."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = hashlib.sha256(
+            (fn.__name__ + repr(args) + repr(sorted(kwargs.items()))).encode()
+        ).hexdigest()[:16]
+        hit = _tool_cache.get(key)
+        if hit and hit[0] > time.time():
+            return hit[1]
+        value = fn(*args, **kwargs)
+        _tool_cache[key] = (time.time() + ttl, value)
+        return value
+    return wrapper
+
+def with_cache(tool: FunctionTool, ttl: float) -> FunctionTool:
+    """Copy of `tool` whose function is wrapped by `cached`."""
+    return FunctionTool.from_defaults(
+        fn=cached(tool.fn, ttl),
+        name=tool.metadata.name,
+        description=tool.metadata.description,
+        fn_schema=tool.metadata.fn_schema,
+    )
+
+# The toolset is built on first use rather than at import time, so importing
+# this module stays cheap and free of side effects.
+@functools.cache
+def get_finance_tools() -> list[FunctionTool]:
+    """Yahoo Finance tools plus our custom math tools."""
+    finance_tools = [
+        with_cache(tool, FINANCE_TOOL_TTLS.get(tool.metadata.name, DEFAULT_TOOL_TTL))
+        for tool in YahooFinanceToolSpec().to_tool_list()
+    ]
+    # Add our custom math tools to the agent’s toolset
+    finance_tools.extend([FunctionTool.from_defaults(fn=multiply), FunctionTool.from_defaults(fn=add)])
+    return finance_tools
+
+SYSTEM_PROMPT = "You are an agent that can perform math and answer finance questions."
 
-# Option B: Google GenAI (default)
-# Uses GOOGLE_API_KEY from .env automatically if not set explicitly
-llm = GoogleGenAI(model="gemini-2.0-flash")
+# ==============================
+# --- Prompt Caching ---
+# ==============================
+# The system prompt and the tool schemas are identical on every turn.
+# Instead of re-sending them with each request, we store them once in a
+# Gemini context cache; cached tokens are billed at a steep discount and
+# shorten time-to-first-token.
+#
+# Gemini only accepts explicit caches above a minimum size. Our prompt
+# and tools are estimated first, and the cache is skipped while they are
+# smaller than that (Gemini's implicit caching still applies). The cache
+# is deleted when the chat ends, so it is not billed for the rest of its TTL.
+MODEL = "gemini-2.0-flash"
+MIN_CACHE_TOKENS = 4096  # smallest explicit cache gemini-2.0-flash accepts
+CACHE_TTL_SECONDS = 3600
+CACHE_TTL = f"{CACHE_TTL_SECONDS}s"
+
+class CachedGoogleGenAI(GoogleGenAI):
+    """GoogleGenAI that reads the system prompt and tools from a context cache."""
+
+    def _prepare_chat_with_tools(self, tools, *args, **kwargs):
+        chat_kwargs = super()._prepare_chat_with_tools(tools, *args, **kwargs)
+        # Gemini rejects requests that repeat the cached system
+        # instruction, tools or tool config, so strip them here.
+        chat_kwargs.pop("tools", None)
+        chat_kwargs.pop("tool_config", None)
+        chat_kwargs["messages"] = [
+            m for m in chat_kwargs["messages"] if m.role != MessageRole.SYSTEM
+        ]
+        return chat_kwargs
+
+def create_prompt_cache(tools) -> str | None:
+    """Cache the system prompt + tool declarations, returning the cache name (or None)."""
+    declarations = [
+        types.FunctionDeclaration(
+            name=tool.metadata.name,
+            description=tool.metadata.description,
+            parameters_json_schema=tool.metadata.get_parameters_dict(),
+        )
+        for tool in tools
+    ]
+    cached_tools = types.Tool(function_declarations=declarations)
+    # Rough size check (see CHARS_PER_TOKEN), avoids a doomed API call
+    size = len(SYSTEM_PROMPT) + len(cached_tools.model_dump_json(exclude_none=True))
+    if size // CHARS_PER_TOKEN < MIN_CACHE_TOKENS:
+        return None
+    try:
+        cache = genai.Client().caches.create(
+            model=MODEL,
+            config=types.CreateCachedContentConfig(
+                system_instruction=SYSTEM_PROMPT,
+                tools=[cached_tools],
+                ttl=CACHE_TTL,
+            ),
+        )
+    except errors.APIError as e:
+        print(f"Prompt cache unavailable ({e}), sending the prompt uncached.")
+        return None
+    return cache.name
+
+@functools.cache
+def get_prompt_cache() -> str | None:
+    """Name of this process's prompt cache, created on first use."""
+    return create_prompt_cache(get_finance_tools())
+
+async def keep_prompt_cache_alive(name: str):
+    """Push the cache's expiry back every half TTL while the chat is open.
+
+    An expired cache would make every following request fail, however
+    long the user has been idle.
+    """
+    client = genai.Client()
+    while True:
+        await asyncio.sleep(CACHE_TTL_SECONDS / 2)
+        try:
+            await client.aio.caches.update(
+                name=name, config=types.UpdateCachedContentConfig(ttl=CACHE_TTL)
+            )
+        except errors.APIError as e:
+            print(f"Could not extend the prompt cache ({e}).")
+
+async def delete_prompt_cache(name: str):
+    """Delete the cache when the chat ends instead of paying for it until it expires."""
+    try:
+        await genai.Client().aio.caches.delete(name=name)
+    except errors.APIError as e:
+        print(f"Could not delete the prompt cache ({e}).")
 
 # ==============================
-# --- Tools Setup ---
+# --- Language Model Setup ---
 # ==============================
-# Yahoo Finance tools (stock data, etc.)
-finance_tools = YahooFinanceToolSpec().to_tool_list()
+# Option A: OpenAI (set USE_OPENAI=1)
+# The OpenAI client is only imported in that case, since pulling it in
+# noticeably slows down startup.
 
-# Add our custom math tools to the agent’s toolset
-finance_tools.extend([multiply, add])
+# Option B: Google GenAI (default)
+# Uses GOOGLE_API_KEY from .env automatically if not set explicitly
+#
+# Interactive chat uses the Priority service tier by default for lower,
+# steadier latency. If the Priority quota is exceeded, requests are served
+# at the Standard tier instead of failing. Override with GEMINI_TIER.
+#
+# Check `usage_metadata.cached_content_token_count` on the raw responses
+# to see how many input tokens were served from the cache.
+@functools.cache
+def get_llm() -> LLM:
+    """Create the LLM (and its prompt cache) once, on first use."""
+    if os.getenv("USE_OPENAI") == "1":
+        from llama_index.llms.openai import OpenAI
+        return OpenAI(model="gpt-4o-mini")
+
+    cache_name = get_prompt_cache()
+    llm_class = CachedGoogleGenAI if cache_name else GoogleGenAI
+    return llm_class(
+        model=MODEL,
+        generation_config=types.GenerateContentConfig(
+            temperature=0.1,  # GoogleGenAI's default, which a custom config replaces
+            service_tier=os.getenv("GEMINI_TIER", "priority"),
+            cached_content=cache_name,
+        ),
+    )
+
+# The prompt cache holds the agent's system prompt and tools, so a plain
+# completion sent through it may come back as a tool call. Summaries
+# (see Context Trimming) therefore go through an uncached model.
+@functools.cache
+def get_summary_llm() -> LLM:
+    """LLM used to summarize old turns, without the prompt cache."""
+    if os.getenv("USE_OPENAI") == "1":
+        return get_llm()
+    return GoogleGenAI(
+        model=MODEL,
+        generation_config=types.GenerateContentConfig(
+            temperature=0.1,
+            service_tier=os.getenv("GEMINI_TIER", "priority"),
+        ),
+    )
 
 # ==============================
 # --- Agent Workflow Setup ---
@@ -72,39 +264,324 @@ finance_tools.extend([multiply, add])
 # - The tools (math + finance)
 # - The language model (LLM)
 # - A system prompt describing what the agent can do
-workflow = AgentWorkflow.from_tools_or_functions(
-    finance_tools,
-    llm=llm,
-    system_prompt="You are an agent that can perform math and answer finance questions."
-)
+@functools.cache
+def build_workflow() -> AgentWorkflow:
+    """Assemble the agent workflow from the tools and the LLM."""
+    return AgentWorkflow.from_tools_or_functions(
+        get_finance_tools(),
+        llm=get_llm(),
+        system_prompt=SYSTEM_PROMPT
+    )
 
 # ==============================
 # --- Context Persistence Setup ---
 # ==============================
 # By default, the agent forgets past conversations when the program ends.
-# To fix this, we serialize the Context to a JSON file (`history.json`)
-# and reload it on the next run.
-
-HISTORY_FILE = "history.json"
+# To fix this, every turn is recorded as a few small events (the user's
+# message, each tool call, the agent's reply) in an append-only table of a
+# SQLite database (`history.db`), and the chat history is rebuilt from
+# those events on the next run.
+#
+# Appending costs the same no matter how long the conversation is, and
+# nothing is ever overwritten: summarizing old turns (see Context Trimming)
+# only adds a marker, so the full history stays in the database.
+
+HISTORY_DB = "history.db"
+HISTORY_FILE = "history.json"  # saved by older versions, imported once if present
+
+# The database is opened on first use, so importing this module does
+# not create any files.
+@functools.cache
+def get_db() -> sqlite3.Connection:
+    """Open history.db (creating the events table if needed) once, on first use."""
+    conn = sqlite3.connect(HISTORY_DB, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS events ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+        "payload BLOB NOT NULL, created_at REAL NOT NULL)"
+    )
+    return conn
+
+FLUSH_DELAY = 0.5  # seconds; writes within this window are coalesced
+
+class EventLog:
+    """Append-only log of chat events, stored in the `events` table.
+
+    Event kinds: "user_msg", "tool_call", "assistant_msg" and
+    "condensation" (a summary that stands in for every event up to `upto`).
+    """
 
-def load_context() -> Context:
-    """Load saved context from history.json if it exists, else start fresh."""
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            ctx_dict = json.load(f)
-        # Rebuild the Context object from saved state
-        return Context.from_dict(workflow, ctx_dict, serializer=JsonSerializer())
-    # If no history file, start a new context
-    return Context(workflow)
+    def __init__(self):
+        self.pending = []
+        self._lock = asyncio.Lock()
+        self._scheduled = None
+        # Event id of the first user turn in the in-memory chat history
+        # (set by view(), moved forward by condense())
+        self.first_turn_id = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return get_db()
+
+    def append(self, kind: str, payload: dict):
+        """Queue an event; it is written to the database on the next flush()."""
+        self.pending.append((kind, _dumps(payload), time.time()))
+
+    def _write(self, rows):
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT INTO events(kind, payload, created_at) VALUES (?, ?, ?)", rows
+        )
+        self.conn.execute("COMMIT")
+
+    async def flush(self):
+        """Write all queued events in one transaction, off the event loop."""
+        async with self._lock:
+            rows, self.pending = self.pending, []
+            if rows:
+                await asyncio.to_thread(self._write, rows)
+
+    def schedule_flush(self):
+        """Flush after FLUSH_DELAY, unless a flush is already scheduled.
+
+        Events appended in the meantime are written by that same flush,
+        so a burst of quick turns costs a single write.
+        """
+        if self._scheduled and not self._scheduled.done():
+            return
+        self._scheduled = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        await self.flush()
+
+    async def close(self):
+        """Wait for a scheduled flush, then write anything still queued."""
+        if self._scheduled:
+            await self._scheduled
+        await self.flush()
+
+    def latest(self, kind: str) -> dict | None:
+        """Payload of the most recent event of the given kind."""
+        row = self.conn.execute(
+            "SELECT payload FROM events WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)
+        ).fetchone()
+        return _loads(row[0]) if row else None
+
+    async def condense(self, summary: str, turns: int):
+        """Record that `summary` replaces the first `turns` user turns of the in-memory history.
+
+        Turns are counted from first_turn_id rather than from the previous
+        marker, since view() may have left out the oldest turns after it.
+        Nothing is deleted: the marker only moves the start of the view forward.
+        """
+        await self.flush()
+        row = self.conn.execute(
+            "SELECT id FROM events WHERE kind = 'user_msg' AND id >= ? ORDER BY id LIMIT 1 OFFSET ?",
+            (self.first_turn_id, turns),
+        ).fetchone()
+        upto = row[0] - 1 if row else self.conn.execute("SELECT MAX(id) FROM events").fetchone()[0]
+        self.append("condensation", {"summary": summary, "upto": upto})
+        await self.flush()
+        self.first_turn_id = upto + 1
+
+    def view(self, max_tokens: int) -> list[ChatMessage]:
+        """Chat history for the LLM: the latest summary plus the turns after it.
+
+        The oldest turns are dropped until the view fits in `max_tokens`.
+        """
+        marker = self.latest("condensation")
+        rows = self.conn.execute(
+            "SELECT id, kind, payload FROM events WHERE id > ? "
+            "AND kind IN ('user_msg', 'assistant_msg') ORDER BY id",
+            (marker["upto"] if marker else 0,),
+        ).fetchall()
+        turns = [
+            ChatMessage(
+                role=MessageRole.USER if kind == "user_msg" else MessageRole.ASSISTANT,
+                content=_loads(payload)["content"],
+            )
+            for _, kind, payload in rows
+        ]
+        head = [ChatMessage(role=MessageRole.USER, content=marker["summary"])] if marker else []
+        while turns and estimate_tokens(head + turns) > max_tokens:
+            turns.pop(0)
+            while turns and turns[0].role != MessageRole.USER:
+                turns.pop(0)
+        # Remember where the returned turns start, for condense()
+        if turns:
+            self.first_turn_id = rows[len(rows) - len(turns)][0]
+        else:
+            self.first_turn_id = (rows[-1][0] + 1) if rows else (marker["upto"] + 1 if marker else 0)
+        return head + turns
+
+event_log = EventLog()
+
+async def import_history_file(workflow: AgentWorkflow):
+    """Copy the chat saved in history.json by older versions into the event log."""
+    with open(HISTORY_FILE, "rb") as f:
+        old_ctx = Context.from_dict(workflow, _loads(f.read()), serializer=JsonSerializer())
+    memory = await old_ctx.get("memory", default=None)
+    for m in memory.get_all() if memory else []:
+        if m.role in (MessageRole.USER, MessageRole.ASSISTANT) and m.content:
+            kind = "user_msg" if m.role == MessageRole.USER else "assistant_msg"
+            event_log.append(kind, {"content": m.content})
+    await event_log.flush()
+
+async def load_context(workflow: AgentWorkflow) -> Context:
+    """Rebuild the context from the event log (a new, empty one if nothing was saved yet)."""
+    if event_log.latest("user_msg") is None and os.path.exists(HISTORY_FILE):
+        await import_history_file(workflow)
+    ctx = Context(workflow)
+    memory = ChatMemoryBuffer.from_defaults(llm=get_llm())
+    messages = event_log.view(max_tokens=int(COMPACT_AT * memory.token_limit))
+    if messages:
+        memory.set(messages)
+        await ctx.set("memory", memory)
+    return ctx
 
-def save_context(ctx: Context):
-    """Save the current conversation context to history.json."""
-    ctx_dict = ctx.to_dict(serializer=JsonSerializer())
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(ctx_dict, f, indent=2)
+# ==============================
+# --- Context Trimming ---
+# ==============================
+# Every turn re-sends the whole chat history, so it would grow without
+# bound. Before each run we estimate its size and, once it gets close to
+# the memory's token limit (75% of the model's context window, the rest
+# is left for the reply), compact it in three passes:
+#   1. tool outputs repeated by a later identical call are blanked,
+#   2. the oldest half of the conversation is replaced by a summary,
+#   3. tool results listed in RETAIN_TOOLS are kept word for word.
+COMPACT_AT = 0.8  # compact once the history fills 80% of the memory's token limit
+CHARS_PER_TOKEN = 4  # rough estimate, avoids a token-counting API call
+RETAIN_TOOLS = set()  # tool results that must survive compaction verbatim
+SUMMARY_PROMPT = "Summarize the following turns concisely preserving names, numbers, tool results."
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+def estimate_tokens(messages) -> int:
+    """Cheap token estimate for a list of chat messages."""
+    return sum(len(str(m.content or "")) for m in messages) // CHARS_PER_TOKEN
+
+def _args_key(args) -> str:
+    """Comparable form of a tool call's arguments (given as a dict or a JSON string)."""
+    if isinstance(args, str):
+        try:
+            args = _loads(args)
+        except ValueError:
+            return args
+    if isinstance(args, dict):
+        return repr(sorted(args.items()))
+    return repr(args)
+
+def _tool_calls(message: ChatMessage):
+    """(call id, tool name, arguments) for the tool calls requested by an assistant message."""
+    for block in message.blocks:
+        if getattr(block, "block_type", None) == "tool_call":
+            yield block.tool_call_id, block.tool_name, _args_key(block.tool_kwargs)
+    for call in message.additional_kwargs.get("tool_calls", []):
+        if isinstance(call, dict):
+            fn = call.get("function") or call
+            yield call.get("id"), fn.get("name"), _args_key(fn.get("arguments", fn.get("args")))
+        else:
+            fn = getattr(call, "function", call)
+            args = getattr(fn, "arguments", getattr(fn, "args", None))
+            yield getattr(call, "id", None), getattr(fn, "name", None), _args_key(args)
+
+def _tool_results(messages: list[ChatMessage]) -> list[tuple[str, str] | None]:
+    """(tool name, arguments) behind each tool message (None for other messages).
+
+    Tool messages only carry the id of their call, so the call is looked up
+    among those of the preceding assistant message (in order, if the
+    provider left the ids empty).
+    """
+    results, pending = [], []
+    for m in messages:
+        result = None
+        if m.role == MessageRole.ASSISTANT:
+            pending = list(_tool_calls(m))
+        elif m.role == MessageRole.TOOL and pending:
+            call_id = m.additional_kwargs.get("tool_call_id")
+            call = next((c for c in pending if call_id and c[0] == call_id), pending[0])
+            pending.remove(call)
+            if call[1]:
+                result = call[1:]
+        results.append(result)
+    return results
+
+async def compact_context(ctx: Context):
+    """Shrink the chat history stored in ctx once it nears the context window."""
+    memory = await ctx.get("memory", default=None)
+    if memory is None:
+        return
+    messages = memory.get_all()
+    if estimate_tokens(messages) < COMPACT_AT * memory.token_limit:
+        return
+
+    # Pass 1: blank out tool results superseded by a later identical call
+    # (same tool, same arguments); the messages themselves stay, so every
+    # tool call keeps its result
+    calls = _tool_results(messages)
+    latest = {call: i for i, call in enumerate(calls) if call}
+    for i, m in enumerate(messages):
+        if calls[i] and latest[calls[i]] != i and calls[i][0] not in RETAIN_TOOLS:
+            m.content = "[superseded by a later call]"
+
+    # Pass 2: summarize the oldest half, cutting at a user turn so that
+    # no tool call is separated from its result
+    cut = len(messages) // 2
+    while cut < len(messages) and messages[cut].role != MessageRole.USER:
+        cut += 1
+    old, recent = messages[:cut], messages[cut:]
+    if not old:
+        return
+    transcript = "\n".join(f"{m.role.value}: {m.content}" for m in old if m.content)
+    summary = await get_summary_llm().acomplete(f"{SUMMARY_PROMPT}\n\n{transcript}")
+    text = f"{SUMMARY_HEADER}\n{summary.text}"
+
+    # Pass 3: pinned tool results are carried over verbatim
+    pinned = [
+        (calls[i][0], m) for i, m in enumerate(old) if calls[i] and calls[i][0] in RETAIN_TOOLS
+    ]
+    if pinned:
+        text += "\n\nKept verbatim:\n" + "\n".join(f"{name}: {m.content}" for name, m in pinned)
+
+    memory.set([ChatMessage(role=MessageRole.USER, content=text)] + recent)
+    await ctx.set("memory", memory)
+
+    # Record the summary in the event log (older events are kept)
+    turns = sum(
+        1 for m in old
+        if m.role == MessageRole.USER and not str(m.content).startswith(SUMMARY_HEADER)
+    )
+    await event_log.condense(text, turns)
 
-# Initialize context (load from file if available)
-ctx = load_context()
+# ==============================
+# --- Speculative Prefetch ---
+# ==============================
+# After a turn that used tools, the agent's next message is often
+# predictable (e.g. a summary of what it found). With PREFETCH=1 we start
+# that follow-up in the background, on a copy of the context, while the
+# user is still typing. If the user just presses Enter, the answer is
+# already there; if they type something else, the prefetch is discarded.
+PREFETCH = os.getenv("PREFETCH") == "1"
+PREFETCH_MSG = "Continue."
+
+def clone_context(workflow: AgentWorkflow, ctx: Context) -> Context:
+    """Independent copy of ctx, so a speculative run cannot touch the real one."""
+    serializer = JsonSerializer()
+    return Context.from_dict(workflow, ctx.to_dict(serializer=serializer), serializer=serializer)
+
+async def run_speculative(handler):
+    """Wait for a follow-up run without printing; returns (response, tool call results)."""
+    tool_results = [ev async for ev in handler.stream_events() if isinstance(ev, ToolCallResult)]
+    return await handler, tool_results
+
+def record_tool_call(event: ToolCallResult):
+    event_log.append("tool_call", {
+        "tool_name": event.tool_name,
+        "tool_kwargs": event.tool_kwargs,
+        "output": str(event.tool_output),
+    })
 
 # ==============================
 # --- Interactive Chat Loop ---
@@ -116,27 +593,92 @@ async def chat_loop():
     - Agent responds with output (Agent).
     - Context is updated and saved after each turn.
     """
+    workflow = build_workflow()
+
+    # Keep the prompt cache alive for as long as the chat runs
+    # (it is deleted again on exit)
+    keep_alive = None
+    if isinstance(get_llm(), CachedGoogleGenAI):
+        keep_alive = asyncio.create_task(keep_prompt_cache_alive(get_prompt_cache()))
+
+    # Initialize context (load from the database if available)
+    ctx = await load_context(workflow)
+
     print(" Interactive Agent Started! Type 'exit' or 'quit' to stop.\n")
 
+    # (handler, task, context) of a follow-up prefetched while the user types
+    speculative = None
+
     while True:
         # --- Get input from user ---
-        user_msg = input("Client: ")
+        # Read stdin in a worker thread so the event loop (and the
+        # background save / prefetch) keeps running while the user types
+        user_msg = await asyncio.to_thread(input, "Client: ")
+
+        # --- Use or discard the prefetched follow-up ---
+        if speculative:
+            spec_handler, task, spec_ctx = speculative
+            speculative = None
+            if user_msg.strip():
+                # Stop the workflow run itself, then let its task finish
+                await spec_handler.cancel_run()
+                await asyncio.gather(task, return_exceptions=True)
+            else:
+                user_msg = PREFETCH_MSG
+                try:
+                    response, tool_results = await task
+                except Exception:
+                    pass  # the prefetch failed; run the turn normally below
+                else:
+                    ctx = spec_ctx
+                    print(f"Agent: {response}\n")
+                    event_log.append("user_msg", {"content": user_msg})
+                    for event in tool_results:
+                        record_tool_call(event)
+                    event_log.append("assistant_msg", {"content": str(response)})
+                    event_log.schedule_flush()
+                    continue
 
         # --- Exit condition ---
         if user_msg.lower() in ["exit", "quit"]:
             print("Ending chat. Saving history...")
-            save_context(ctx)  # Save state before quitting
+            await event_log.close()  # Save state before quitting
             print("History saved. Goodbye!")
+            if keep_alive:
+                keep_alive.cancel()
+                await delete_prompt_cache(get_prompt_cache())
             break
 
-        # --- Run the workflow with the user’s message ---
-        response = await workflow.run(user_msg=user_msg, ctx=ctx)
+        event_log.append("user_msg", {"content": user_msg})
 
-        # --- Print agent response ---
-        print(f"Agent: {response}\n")
+        # --- Keep the history within the context window ---
+        await compact_context(ctx)
 
-        # --- Save context after each turn ---
-        save_context(ctx)
+        # --- Run the workflow with the user’s message ---
+        handler = workflow.run(user_msg=user_msg, ctx=ctx)
+
+        # --- Stream the agent response as it is generated ---
+        print("Agent: ", end="", flush=True)
+        used_tools = False
+        async for event in handler.stream_events():
+            if isinstance(event, AgentStream):
+                print(event.delta, end="", flush=True)
+            elif isinstance(event, ToolCallResult):
+                used_tools = True
+                record_tool_call(event)
+        response = await handler
+        print("\n")
+        event_log.append("assistant_msg", {"content": str(response)})
+
+        # --- Write this turn's events in the background ---
+        # Writes are debounced: quick back-and-forth turns share one write
+        event_log.schedule_flush()
+
+        # --- Prefetch the likely follow-up while the user types ---
+        if PREFETCH and used_tools:
+            spec_ctx = clone_context(workflow, ctx)
+            spec_handler = workflow.run(user_msg=PREFETCH_MSG, ctx=spec_ctx)
+            speculative = (spec_handler, asyncio.create_task(run_speculative(spec_handler)), spec_ctx)
 
 # ==============================
 # --- Entry Point ---
@@ -6,20 +6,39 @@ This script demonstrates:
 - The agent has a custom tool (`set_name`) that stores a user's name.
 - The agent uses a language model (Google GenAI by default, OpenAI as an option).
 - A Context object is used to maintain memory across turns.
-- Memory is saved into a file (`history.json`) so the agent remembers even after restart.
+- Every turn is appended to an event log in a SQLite database (`history.db`) so the agent remembers even after restart.
 - The script runs an interactive terminal loop where the user types a message
   and the agent responds.
 """
 
 import asyncio
-import json
+import functools
 import os
+import sqlite3
+import time
 from dotenv import load_dotenv
 
+# Fast JSON (falls back to the standard library if orjson is not installed)
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    _loads = json.loads
+
 # Import required LlamaIndex modules
-from llama_index.llms.openai import OpenAI
+# (the OpenAI LLM is imported further down, only if it is selected)
 from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.core.agent.workflow import AgentWorkflow
+from google.genai import types
+from llama_index.core.agent.workflow import AgentStream, AgentWorkflow, ToolCallResult
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.workflow import Context, JsonSerializer
 
 # ================================================================
@@ -38,15 +57,32 @@ load_dotenv()
 # Language Model Setup
 # ================================================================
 # You can choose between OpenAI or Google GenAI.
-# Uncomment the OpenAI line if you want to use OpenAI.
+# Set USE_OPENAI=1 in the environment if you want to use OpenAI.
 # The default here is Google GenAI.
 #
+# The OpenAI client library is large and slow to import, so it is
+# only imported when it is actually used.
+#
 # Note: The API key will be automatically pulled from the environment.
 # For Google, the variable is GOOGLE_API_KEY.
 # For OpenAI, the variable is OPENAI_API_KEY.
+#
+# Since this is an interactive chat, Google GenAI requests use the
+# Priority service tier by default (lower, more predictable latency).
+# Requests over the Priority quota are downgraded to the Standard tier
+# rather than rejected. Set GEMINI_TIER to pick another tier.
 
-# llm = OpenAI(model="gpt-4o-mini")   # Option A: OpenAI
-llm = GoogleGenAI(model="gemini-2.0-flash")  # Option B: Google GenAI
+if os.getenv("USE_OPENAI") == "1":  # Option A: OpenAI
+    from llama_index.llms.openai import OpenAI
+    llm = OpenAI(model="gpt-4o-mini")
+else:
+    llm = GoogleGenAI(  # Option B: Google GenAI
+        model="gemini-2.0-flash",
+        generation_config=types.GenerateContentConfig(
+            temperature=0.1,  # GoogleGenAI's default, which a custom config replaces
+            service_tier=os.getenv("GEMINI_TIER", "priority"),
+        ),
+    )
 
 # ================================================================
 # Custom Tool Definition
@@ -94,30 +130,340 @@ workflow = AgentWorkflow.from_tools_or_functions(
 # Context Persistence (Save/Load)
 # ================================================================
 # The Context allows memory during a single session.
-# To persist memory across sessions, we serialize the Context
-# to a JSON file called `history.json`.
-# This way, if you stop the program and restart, the agent
-# will still remember the previous state.
-HISTORY_FILE = "history.json"
+# To persist memory across sessions, every turn is recorded as a
+# handful of small events (user message, tool calls, agent reply,
+# and the agent's state) in an append-only table of a SQLite
+# database (`history.db`). On restart the chat history and state
+# are rebuilt from these events, so the agent will still remember.
+#
+# Appending a few rows costs the same however long the chat is,
+# and events are never rewritten or deleted. Summarizing old turns
+# (see Context Trimming) just appends a "condensation" marker, so
+# the complete audit trail stays in the database.
+HISTORY_DB = "history.db"
+HISTORY_FILE = "history.json"  # saved by older versions, imported once if present
+
+# The database is opened on first use, so importing this module does
+# not create any files.
+@functools.cache
+def get_db() -> sqlite3.Connection:
+    """Open history.db (creating the events table if needed) once, on first use."""
+    conn = sqlite3.connect(HISTORY_DB, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS events ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+        "payload BLOB NOT NULL, created_at REAL NOT NULL)"
+    )
+    return conn
+
+FLUSH_DELAY = 0.5  # seconds; writes within this window are coalesced
+
+class EventLog:
+    """Append-only log of chat events, stored in the `events` table.
+
+    Event kinds: "user_msg", "tool_call", "assistant_msg", "state" and
+    "condensation" (a summary that stands in for every event up to `upto`).
+    """
+
+    def __init__(self):
+        self.pending = []
+        self._lock = asyncio.Lock()
+        self._scheduled = None
+        # Event id of the first user turn in the in-memory chat history
+        # (set by view(), moved forward by condense())
+        self.first_turn_id = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return get_db()
+
+    def append(self, kind: str, payload: dict):
+        """Queue an event; it is written to the database on the next flush()."""
+        self.pending.append((kind, _dumps(payload), time.time()))
+
+    def _write(self, rows):
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT INTO events(kind, payload, created_at) VALUES (?, ?, ?)", rows
+        )
+        self.conn.execute("COMMIT")
+
+    async def flush(self):
+        """Write all queued events in one transaction, off the event loop."""
+        async with self._lock:
+            rows, self.pending = self.pending, []
+            if rows:
+                await asyncio.to_thread(self._write, rows)
+
+    def schedule_flush(self):
+        """Flush after FLUSH_DELAY, unless a flush is already scheduled.
+
+        Events appended in the meantime are written by that same flush,
+        so a burst of quick turns costs a single write.
+        """
+        if self._scheduled and not self._scheduled.done():
+            return
+        self._scheduled = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        await self.flush()
+
+    async def close(self):
+        """Wait for a scheduled flush, then write anything still queued."""
+        if self._scheduled:
+            await self._scheduled
+        await self.flush()
+
+    def latest(self, kind: str) -> dict | None:
+        """Payload of the most recent event of the given kind."""
+        row = self.conn.execute(
+            "SELECT payload FROM events WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)
+        ).fetchone()
+        return _loads(row[0]) if row else None
+
+    async def condense(self, summary: str, turns: int):
+        """Record that `summary` replaces the first `turns` user turns of the in-memory history.
+
+        Turns are counted from first_turn_id rather than from the previous
+        marker, since view() may have left out the oldest turns after it.
+        Nothing is deleted: the marker only moves the start of the view forward.
+        """
+        await self.flush()
+        row = self.conn.execute(
+            "SELECT id FROM events WHERE kind = 'user_msg' AND id >= ? ORDER BY id LIMIT 1 OFFSET ?",
+            (self.first_turn_id, turns),
+        ).fetchone()
+        upto = row[0] - 1 if row else self.conn.execute("SELECT MAX(id) FROM events").fetchone()[0]
+        self.append("condensation", {"summary": summary, "upto": upto})
+        await self.flush()
+        self.first_turn_id = upto + 1
+
+    def view(self, max_tokens: int) -> list[ChatMessage]:
+        """Chat history for the LLM: the latest summary plus the turns after it.
+
+        The oldest turns are dropped until the view fits in `max_tokens`.
+        """
+        marker = self.latest("condensation")
+        rows = self.conn.execute(
+            "SELECT id, kind, payload FROM events WHERE id > ? "
+            "AND kind IN ('user_msg', 'assistant_msg') ORDER BY id",
+            (marker["upto"] if marker else 0,),
+        ).fetchall()
+        turns = [
+            ChatMessage(
+                role=MessageRole.USER if kind == "user_msg" else MessageRole.ASSISTANT,
+                content=_loads(payload)["content"],
+            )
+            for _, kind, payload in rows
+        ]
+        head = [ChatMessage(role=MessageRole.USER, content=marker["summary"])] if marker else []
+        while turns and estimate_tokens(head + turns) > max_tokens:
+            turns.pop(0)
+            while turns and turns[0].role != MessageRole.USER:
+                turns.pop(0)
+        # Remember where the returned turns start, for condense()
+        if turns:
+            self.first_turn_id = rows[len(rows) - len(turns)][0]
+        else:
+            self.first_turn_id = (rows[-1][0] + 1) if rows else (marker["upto"] + 1 if marker else 0)
+        return head + turns
+
+event_log = EventLog()
+
+async def import_history_file():
+    """
+    Copy the chat history and state that older versions of this
+    script saved in history.json into the event log.
+    """
+    with open(HISTORY_FILE, "rb") as f:
+        old_ctx = Context.from_dict(workflow, _loads(f.read()), serializer=JsonSerializer())
+    memory = await old_ctx.get("memory", default=None)
+    for m in memory.get_all() if memory else []:
+        if m.role in (MessageRole.USER, MessageRole.ASSISTANT) and m.content:
+            kind = "user_msg" if m.role == MessageRole.USER else "assistant_msg"
+            event_log.append(kind, {"content": m.content})
+    state = await old_ctx.get("state", default=None)
+    if state is not None:
+        event_log.append("state", state)
+    await event_log.flush()
 
-def load_context() -> Context:
+async def load_context() -> Context:
     """
-    Load saved context from history.json if available.
-    If no file exists, create a new empty context.
+    Rebuild the context from the event log: the chat history comes
+    from the log's view and the state from the latest "state" event.
+    On the first run, an older history.json is imported first.
+    Without either, a new empty context is created.
     """
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            ctx_dict = json.load(f)
-        return Context.from_dict(workflow, ctx_dict, serializer=JsonSerializer())
-    return Context(workflow)
+    if event_log.latest("user_msg") is None and os.path.exists(HISTORY_FILE):
+        await import_history_file()
+    ctx = Context(workflow)
+    memory = ChatMemoryBuffer.from_defaults(llm=llm)
+    messages = event_log.view(max_tokens=int(COMPACT_AT * memory.token_limit))
+    if messages:
+        memory.set(messages)
+        await ctx.set("memory", memory)
+    state = event_log.latest("state")
+    if state is not None:
+        await ctx.set("state", state)
+    return ctx
 
-def save_context(ctx: Context):
+# ================================================================
+# Context Trimming
+# ================================================================
+# The whole chat history is sent to the model on every turn, so a
+# long session keeps getting more expensive and will eventually
+# overflow the context window. Before each turn we estimate the
+# history size (characters / 4, no API call needed) and, once it
+# reaches 80% of the memory's token limit (which ChatMemoryBuffer sets
+# to 75% of the context window), compact it in three passes:
+#   1. Tool outputs superseded by a newer identical call (same tool and
+#      arguments) are blanked.
+#   2. The oldest half of the conversation is summarized by the LLM.
+#   3. Results of tools in RETAIN_TOOLS (the user's name) are kept verbatim.
+COMPACT_AT = 0.8  # compact once the history fills 80% of the memory's token limit
+CHARS_PER_TOKEN = 4  # rough estimate, avoids a token-counting API call
+RETAIN_TOOLS = {"set_name"}  # the user's name must never be summarized away
+SUMMARY_PROMPT = "Summarize the following turns concisely preserving names, numbers, tool results."
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+
+def estimate_tokens(messages) -> int:
+    """Cheap token estimate for a list of chat messages."""
+    return sum(len(str(m.content or "")) for m in messages) // CHARS_PER_TOKEN
+
+def _args_key(args) -> str:
+    """Comparable form of a tool call's arguments (given as a dict or a JSON string)."""
+    if isinstance(args, str):
+        try:
+            args = _loads(args)
+        except ValueError:
+            return args
+    if isinstance(args, dict):
+        return repr(sorted(args.items()))
+    return repr(args)
+
+def _tool_calls(message: ChatMessage):
+    """(call id, tool name, arguments) for the tool calls requested by an assistant message."""
+    for block in message.blocks:
+        if getattr(block, "block_type", None) == "tool_call":
+            yield block.tool_call_id, block.tool_name, _args_key(block.tool_kwargs)
+    for call in message.additional_kwargs.get("tool_calls", []):
+        if isinstance(call, dict):
+            fn = call.get("function") or call
+            yield call.get("id"), fn.get("name"), _args_key(fn.get("arguments", fn.get("args")))
+        else:
+            fn = getattr(call, "function", call)
+            args = getattr(fn, "arguments", getattr(fn, "args", None))
+            yield getattr(call, "id", None), getattr(fn, "name", None), _args_key(args)
+
+def _tool_results(messages: list[ChatMessage]) -> list[tuple[str, str] | None]:
+    """(tool name, arguments) behind each tool message (None for other messages).
+
+    Tool messages only carry the id of their call, so the call is looked up
+    among those of the preceding assistant message (in order, if the
+    provider left the ids empty).
+    """
+    results, pending = [], []
+    for m in messages:
+        result = None
+        if m.role == MessageRole.ASSISTANT:
+            pending = list(_tool_calls(m))
+        elif m.role == MessageRole.TOOL and pending:
+            call_id = m.additional_kwargs.get("tool_call_id")
+            call = next((c for c in pending if call_id and c[0] == call_id), pending[0])
+            pending.remove(call)
+            if call[1]:
+                result = call[1:]
+        results.append(result)
+    return results
+
+async def compact_context(ctx: Context):
+    """Shrink the chat history stored in ctx once it nears the context window."""
+    memory = await ctx.get("memory", default=None)
+    if memory is None:
+        return
+    messages = memory.get_all()
+    if estimate_tokens(messages) < COMPACT_AT * memory.token_limit:
+        return
+
+    # Pass 1: blank out tool results superseded by a later identical call
+    # (same tool, same arguments); the messages themselves stay, so every
+    # tool call keeps its result
+    calls = _tool_results(messages)
+    latest = {call: i for i, call in enumerate(calls) if call}
+    for i, m in enumerate(messages):
+        if calls[i] and latest[calls[i]] != i and calls[i][0] not in RETAIN_TOOLS:
+            m.content = "[superseded by a later call]"
+
+    # Pass 2: summarize the oldest half, cutting at a user turn so that
+    # no tool call is separated from its result
+    cut = len(messages) // 2
+    while cut < len(messages) and messages[cut].role != MessageRole.USER:
+        cut += 1
+    old, recent = messages[:cut], messages[cut:]
+    if not old:
+        return
+    transcript = "\n".join(f"{m.role.value}: {m.content}" for m in old if m.content)
+    summary = await llm.acomplete(f"{SUMMARY_PROMPT}\n\n{transcript}")
+    text = f"{SUMMARY_HEADER}\n{summary.text}"
+
+    # Pass 3: pinned tool results are carried over verbatim
+    pinned = [
+        (calls[i][0], m) for i, m in enumerate(old) if calls[i] and calls[i][0] in RETAIN_TOOLS
+    ]
+    if pinned:
+        text += "\n\nKept verbatim:\n" + "\n".join(f"{name}: {m.content}" for name, m in pinned)
+
+    memory.set([ChatMessage(role=MessageRole.USER, content=text)] + recent)
+    await ctx.set("memory", memory)
+
+    # Append a condensation marker to the event log; the summarized
+    # events themselves stay in the database
+    turns = sum(
+        1 for m in old
+        if m.role == MessageRole.USER and not str(m.content).startswith(SUMMARY_HEADER)
+    )
+    await event_log.condense(text, turns)
+
+# ================================================================
+# Speculative Prefetch
+# ================================================================
+# Between the agent's reply and the user's next message the program
+# is idle. After a turn that used a tool, the agent's next message is
+# often predictable, so with PREFETCH=1 we start it in the background
+# on a copy of the context while the user is typing.
+# If the user simply presses Enter, the prefetched answer is shown
+# right away; if they type anything else, it is thrown away.
+PREFETCH = os.getenv("PREFETCH") == "1"
+PREFETCH_MSG = "Continue."
+
+def clone_context(ctx: Context) -> Context:
+    """
+    Make an independent copy of the context (via to_dict/from_dict),
+    so a speculative run never changes the real conversation.
     """
-    Save the current context into history.json for persistence.
+    serializer = JsonSerializer()
+    return Context.from_dict(workflow, ctx.to_dict(serializer=serializer), serializer=serializer)
+
+async def run_speculative(handler):
+    """
+    Wait for a follow-up run without printing anything.
+    Returns the response and the tool call results it produced.
     """
-    ctx_dict = ctx.to_dict(serializer=JsonSerializer())
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(ctx_dict, f, indent=2)
+    tool_results = [ev async for ev in handler.stream_events() if isinstance(ev, ToolCallResult)]
+    return await handler, tool_results
+
+def record_tool_call(event: ToolCallResult):
+    """
+    Record a tool call (e.g. set_name) in the event log.
+    """
+    event_log.append("tool_call", {
+        "tool_name": event.tool_name,
+        "tool_kwargs": event.tool_kwargs,
+        "output": str(event.tool_output),
+    })
 
 # ================================================================
 # Interactive Chat Loop
@@ -129,29 +475,91 @@ def save_context(ctx: Context):
 # is preserved even if the program exits.
 async def chat_loop():
     # Load previous context if it exists, otherwise start fresh
-    ctx = load_context()
+    ctx = await load_context()
 
     print("Interactive Agent Started. Type 'exit' or 'quit' to end.\n")
 
+    # (handler, task, context) of a follow-up prefetched while the user types
+    speculative = None
+
     while True:
-        # Prompt the user for input
-        user_msg = input("Client: ")
+        # Prompt the user for input.
+        # input() blocks, so it runs in a worker thread; this keeps the
+        # event loop free to finish the background save (and any
+        # prefetch) while the user types.
+        user_msg = await asyncio.to_thread(input, "Client: ")
+
+        # An empty message continues the conversation: use the prefetched
+        # follow-up if there is one. Anything else discards it.
+        if speculative:
+            spec_handler, task, spec_ctx = speculative
+            speculative = None
+            if user_msg.strip():
+                # Cancelling only the task would leave the workflow
+                # running, so cancel the run and wait for it to stop
+                await spec_handler.cancel_run()
+                await asyncio.gather(task, return_exceptions=True)
+            else:
+                user_msg = PREFETCH_MSG
+                try:
+                    response, tool_results = await task
+                except Exception:
+                    pass  # the prefetch failed, so run the turn normally
+                else:
+                    ctx = spec_ctx
+                    print(f"Agent: {response}\n")
+                    event_log.append("user_msg", {"content": user_msg})
+                    for event in tool_results:
+                        record_tool_call(event)
+                    event_log.append("assistant_msg", {"content": str(response)})
+                    event_log.append("state", await ctx.get("state"))
+                    event_log.schedule_flush()
+                    continue
 
         # If the user types exit, quit the loop
         if user_msg.lower() in ["exit", "quit"]:
             print("Ending chat. Saving memory...")
-            save_context(ctx)
+            await event_log.close()
             print("Memory saved. Goodbye!")
             break
 
+        # Record the user's message
+        event_log.append("user_msg", {"content": user_msg})
+
+        # Compact the history if it is getting close to the context window
+        await compact_context(ctx)
+
         # Run the workflow with the user message
-        response = await workflow.run(user_msg=user_msg, ctx=ctx)
+        handler = workflow.run(user_msg=user_msg, ctx=ctx)
+
+        # Stream the agent's response token by token (see 4_streaming.py),
+        # so the reply starts appearing as soon as the model produces it
+        print("Agent: ", end="", flush=True)
+        used_tools = False
+        async for event in handler.stream_events():
+            if isinstance(event, AgentStream):
+                print(event.delta, end="", flush=True)
+            elif isinstance(event, ToolCallResult):
+                used_tools = True
+                record_tool_call(event)
+        response = await handler
+        print("\n")
+
+        # Record the agent's reply and the (possibly updated) state
+        event_log.append("assistant_msg", {"content": str(response)})
+        event_log.append("state", await ctx.get("state"))
 
-        # Print the agent's response
-        print(f"Agent: {response}\n")
+        # Write this turn's events in the background, so the user can
+        # start typing right away. Saves are debounced (at most one write
+        # per FLUSH_DELAY), so a rapid exchange does not hit the disk on
+        # every single turn.
+        event_log.schedule_flush()
 
-        # Save the context after each interaction
-        save_context(ctx)
+        # If a tool was used, prefetch the likely follow-up in the background
+        if PREFETCH and used_tools:
+            spec_ctx = clone_context(ctx)
+            spec_handler = workflow.run(user_msg=PREFETCH_MSG, ctx=spec_ctx)
+            speculative = (spec_handler, asyncio.create_task(run_speculative(spec_handler)), spec_ctx)
 
 # ================================================================
 # Entry Point
@@ -7,11 +7,15 @@ Clean Web Search Agent with Streaming Output
 
 import os
 import asyncio
+import functools
+import hashlib
+import time
 from dotenv import load_dotenv
 
 # Import LlamaIndex modules
 from llama_index.llms.openai import OpenAI
 from llama_index.core.agent.workflow import AgentWorkflow
+from llama_index.core.tools import FunctionTool
 from llama_index.tools.tavily_research import TavilyToolSpec
 
 # Event classes for streaming
@@ -26,14 +30,50 @@ from llama_index.core.agent.workflow import (
 load_dotenv()
 
 # Setup OpenAI LLM
-llm = OpenAI(model="gpt-4o-mini")
+# Interactive output, so ask for the Priority service tier by default.
+# Over the Priority limit, requests fall back to the default tier instead
+# of failing. Override with OPENAI_TIER (e.g. "flex" or "default").
+llm = OpenAI(
+    model="gpt-4o-mini",
+    additional_kwargs={"service_tier": os.getenv("OPENAI_TIER", "priority")},
+)
 
 # Setup Tavily web search tool
 tavily_tool = TavilyToolSpec(api_key=os.getenv("TAVILY_API_KEY"))
 
+# Cache search results for a few minutes so repeating a query does not
+# cost another Tavily round-trip (and API credit)
+SEARCH_TTL = 300
+
+_tool_cache: dict[str, tuple[float, object]] = {}
+
+def cached(fn, ttl: float):
+    """Reuse a tool's result for `ttl` seconds when it is called again with the same arguments."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = hashlib.sha256(
+            (fn.__name__ + repr(args) + repr(sorted(kwargs.items()))).encode()
+        ).hexdigest()[:16]
+        hit = _tool_cache.get(key)
+        if hit and hit[0] > time.time():
+            return hit[1]
+        value = fn(*args, **kwargs)
+        _tool_cache[key] = (time.time() + ttl, value)
+        return value
+    return wrapper
+
+def with_cache(tool: FunctionTool, ttl: float) -> FunctionTool:
+    """Copy of `tool` whose function is wrapped by `cached`."""
+    return FunctionTool.from_defaults(
+        fn=cached(tool.fn, ttl),
+        name=tool.metadata.name,
+        description=tool.metadata.description,
+        fn_schema=tool.metadata.fn_schema,
+    )
+
 # Create an agent workflow with the Tavily tool
 workflow = AgentWorkflow.from_tools_or_functions(
-    tavily_tool.to_tool_list(),
+    [with_cache(tool, SEARCH_TTL) for tool in tavily_tool.to_tool_list()],
     llm=llm,
     system_prompt="You're a helpful assistant that can search the web for information."
 )